@@ -1,17 +1,102 @@
 #import all necessary packages and libraries, dash has even more features that can be incorporated
 import base64
 import datetime
+import functools
+import hashlib
 import io
+import json
+import os
+import re
+import shutil
+import tempfile
 import traceback
+import uuid
 
+import numpy as np
 import pandas as pd
 import plotly.express as px
-from dash import Dash, dcc, html, Input, Output, State, dash_table
+from dash import Dash, dcc, html, Input, Output, State, ctx, dash_table
 import dash_bootstrap_components as dbc
 import plotly.graph_objects as go
+from flask import Response, jsonify, request
+
+#Arrow export is only offered when pyarrow is installed
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+#Server settings, read from the environment so the same file runs locally and in production
+DEBUG = os.environ.get('DASH_DEBUG', 'false').lower() in ('1', 'true', 'yes')
+HOST = os.environ.get('HOST', '127.0.0.1')
+PORT = int(os.environ.get('PORT', 8152))
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 31536000))  # seconds, Dash fingerprints its assets so a long cache is safe
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', os.path.join(tempfile.gettempdir(), 'times-dash-uploads'))  # set this in production
+UPLOAD_MAX_DATASETS = int(os.environ.get('UPLOAD_MAX_DATASETS', 50))  # uploads kept on disk, the least recently uploaded are removed
+DATASET_CACHE_SIZE = int(os.environ.get('DATASET_CACHE_SIZE', 8))  # number of parsed uploads kept in memory per process
+EXPORT_CHUNK_ROWS = 10000  # rows per chunk when streaming exports
+DATASET_ID_PATTERN = re.compile(r'[0-9a-f]{40}')
+PROFILE_SAMPLE_ROWS = 100  # rows read from each sheet to check it before the full parse
+EXPLORER_PAGE_SIZE = 25  # rows per page in the data explorer
+EXPLORER_CACHE_SIZE = 32  # row orders of sorted/filtered sheets kept in memory per worker
+CACHE_DIR = os.environ.get('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'times-dash-cache'))  # background job state for diskcache
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL')  # e.g. redis://localhost:6379/0, runs uploads on Celery workers
+
+
+#Create a folder only this user can use, the defaults live in the shared temp directory so refuse a folder
+#that someone else created first or that other users can write to
+def private_folder(path):
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if hasattr(os, 'getuid') and (st.st_uid != os.getuid() or st.st_mode & 0o022):
+        raise RuntimeError(f"'{path}' is not a private folder owned by this user, set a different location")
+    return path
+
+
+#Uploads are kept in a private folder, by default in the shared temp directory
+private_folder(UPLOAD_FOLDER)
+
+#Response compression (gzip, and brotli if installed) is only switched on when flask-compress is available
+try:
+    from flask_compress import Compress
+except ImportError:
+    Compress = None
+
+#Uploads are parsed in the background so one slow upload does not hold up the worker serving everyone else.
+#With CELERY_BROKER_URL set they run on Celery workers (celery -A dash_TIMES_dashboard:celery_app worker),
+#otherwise in a local process when diskcache is installed, which is meant for development and single servers
+celery_app = None
+if CELERY_BROKER_URL:
+    from celery import Celery
+    from dash import CeleryManager
+    celery_app = Celery(__name__, broker=CELERY_BROKER_URL,
+                        backend=os.environ.get('CELERY_RESULT_BACKEND', CELERY_BROKER_URL))
+    background_callback_manager = CeleryManager(celery_app)
+else:
+    try:
+        import diskcache
+        from dash import DiskcacheManager
+        background_callback_manager = DiskcacheManager(diskcache.Cache(private_folder(CACHE_DIR)))
+    except ImportError:
+        background_callback_manager = None
 
 #Initialise the app, the LUX theme is applied, there are several Dash themes to choose from
-app = Dash(__name__, external_stylesheets=[dbc.themes.LUX], suppress_callback_exceptions=True)
+app = Dash(
+    __name__,
+    external_stylesheets=[dbc.themes.LUX],
+    suppress_callback_exceptions=True,
+    background_callback_manager=background_callback_manager,
+)
+
+#Flask server behind the app, this is what Gunicorn serves: gunicorn dash_TIMES_dashboard:server
+server = app.server
+server.config['SEND_FILE_MAX_AGE_DEFAULT'] = STATIC_MAX_AGE
+
+#Compress is set up here rather than with Dash(compress=True), its settings are read when it is created
+if Compress is not None:
+    server.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+    server.config['COMPRESS_STREAMS'] = False  # leave the streamed exports alone, compressing buffers them and rewrites the ETag
+    Compress(server)
 
 #Set colour theme
 colors = {
@@ -44,6 +129,51 @@ naming_convention = {
     
 }
 
+#Define the charts drawn for each sheet, this is the place to add, remove or restyle graphs
+#'type' is 'line' or 'bar', 'y' is the column plotted (summed per Period unless 'aggregate' is False),
+#'group' splits the series by the first or last three letters of the Commodity code,
+#'strip_suffix' removes a suffix from the Commodity code before grouping,
+#'annual_only' keeps only the ANNUAL timeslice (on by default)
+chart_specs = {
+    'emission': {
+        'type': 'line', 'group': 'First_Three_Letters', 'line_dash': True,
+        'title': "Emissions", 'yaxis_title': "Mt", 'legend_title': "Industry",
+    },
+    'co2price': {
+        'type': 'line', 'y': 'Pv_update', 'aggregate': False,
+        'title': "Carbon Price Over Time", 'yaxis_title': "Price (currency)",
+    },
+    'eleccap': {
+        'type': 'line',
+        'title': "Electricity Capacity", 'yaxis_title': "Total Capacity (GW)",
+    },
+    'elecgen': {
+        'type': 'line', 'annual_only': False,
+        'title': "Electricity Generated", 'yaxis_title': "Electricity Generated (PJ)",
+    },
+    'transemix': {
+        'type': 'bar', 'group': 'Last_Three_Letters',
+        'title': "Transport Sector Energy Mix", 'yaxis_title': "PJ", 'legend_title': "Industry",
+    },
+    'indemix': {
+        'type': 'bar', 'group': 'Last_Three_Letters',
+        'title': "Industrial Sector Energy Mix", 'yaxis_title': "PJ", 'legend_title': "Industry",
+    },
+    'resmix': {
+        'type': 'bar', 'group': 'Last_Three_Letters', 'strip_suffix': 'HOUSE', 'annual_only': False,
+        'title': "Residential Sector Energy Mix", 'yaxis_title': "PJ", 'legend_title': "Industry",
+    },
+    'sermix': {
+        'type': 'bar', 'group': 'Last_Three_Letters', 'strip_suffix': 'BUILD', 'annual_only': False,
+        'title': "Service Sector Energy Mix", 'yaxis_title': "Mt", 'legend_title': "Industry",
+    },
+}
+
+#Parsed sheets and chart data saved on disk are keyed by this version, so changing chart_specs never serves old results
+#bump AGGREGATION_VERSION when aggregate_chart changes
+AGGREGATION_VERSION = 1
+CHART_SPECS_VERSION = hashlib.sha1(json.dumps([AGGREGATION_VERSION, chart_specs], sort_keys=True).encode()).hexdigest()[:12]
+
 #Content to the 'About' tab
 about_content = dbc.Modal(
     [
@@ -103,8 +233,29 @@ upload_area = dbc.Container([
     # Display upload status message
     html.Div(id='upload-status', style={'margin': '10px', 'fontSize': '14px', 'color': colors['text']}),
 
-    # Display the generated graphs in two columns
-    dbc.Row(id='graph-container', style={'margin-top': '20px'}),
+    # Id of the uploaded dataset, used by the data explorer
+    dcc.Store(id='dataset-id'),
+
+    dbc.Tabs([
+        # Display the generated graphs in two columns
+        dbc.Tab(dbc.Row(id='graph-container', style={'margin-top': '20px'}), label="Charts", tab_id='charts'),
+
+        # Data explorer, one tab per loaded sheet, pages are sorted and filtered on the server
+        dbc.Tab([
+            dbc.Tabs(id='explorer-sheets', style={'margin-top': '20px'}),
+            dash_table.DataTable(
+                id='explorer-table',
+                page_current=0,
+                page_size=EXPLORER_PAGE_SIZE,
+                page_action='custom',
+                sort_action='custom',
+                sort_mode='multi',
+                filter_action='custom',
+                filter_query='',
+                style_table={'overflowX': 'auto'},
+            ),
+        ], label="Data explorer", tab_id='explorer'),
+    ], active_tab='charts', style={'margin-top': '20px'}),
 
 ], style={'backgroundColor': colors['background']}, className="pt-5 pb-5")
 
@@ -127,206 +278,533 @@ def toggle_about_modal(n1, n2, is_open):
     return is_open
 
 
-#function that reads through file and creates the dictionary of the dataframes
-def parse_contents(contents):
-    try:
-        content_type, content_string = contents.split(',')
-        decoded = base64.b64decode(content_string)
+#Each upload gets its own folder under UPLOAD_FOLDER, named by the hash of the file (the dataset id used by
+#the dashboard and the export API). The parsed sheets and chart data are saved next to the upload, so the
+#background upload process, every Gunicorn worker and the export API all share one parse of each file
+def save_upload(contents):
+    content_type, content_string = contents.split(',')
+    if 'openxml' not in content_type:
+        return None
 
-        
-        if 'openxml' in content_type:
-            xls = pd.ExcelFile(io.BytesIO(decoded))
-            dataframes_dict = {}  # Dictionary to store DataFrames
+    decoded = base64.b64decode(content_string)
+    dataset_id = hashlib.sha1(decoded).hexdigest()
+    path = dataset_path(dataset_id)
+    if os.path.exists(path):
+        os.utime(dataset_dir(dataset_id))  # uploaded again, keep it longest
+    else:
+        def write_upload(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                f.write(decoded)
+        write_atomic(path, write_upload)
+        evict_uploads()
+    return dataset_id
 
-            for sheet_name in xls.sheet_names:
-                df = pd.read_excel(xls, sheet_name=sheet_name)
-                print(f"Loaded DataFrame for sheet '{sheet_name}':\n{df.head()}")
-                dataframes_dict[sheet_name] = df
 
-            return dataframes_dict
+#Remove the least recently uploaded datasets beyond UPLOAD_MAX_DATASETS so the upload folder does not grow forever
+def evict_uploads():
+    entries = [entry for entry in os.scandir(UPLOAD_FOLDER)
+               if entry.is_dir() and DATASET_ID_PATTERN.fullmatch(entry.name)]
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[UPLOAD_MAX_DATASETS:]:
+        print(f"Removing old upload '{entry.name}'")
+        shutil.rmtree(entry.path, ignore_errors=True)
 
-    except Exception as e:
-        print(f"An error occurred while parsing contents: {str(e)}")
 
-    print("No DataFrame found.")
-    return {}
+def dataset_dir(dataset_id):
+    if not DATASET_ID_PATTERN.fullmatch(dataset_id):
+        raise ValueError(f"Invalid dataset id '{dataset_id}'")
+    return os.path.join(UPLOAD_FOLDER, dataset_id)
+
+
+def dataset_path(dataset_id):
+    return os.path.join(dataset_dir(dataset_id), 'upload.xlsx')
+
+
+def cache_path(dataset_id, name):
+    return os.path.join(dataset_dir(dataset_id), CHART_SPECS_VERSION, name)
+
+
+#Sheets and chart data are saved as Parquet when pyarrow is installed and as CSV otherwise,
+#neither runs any code when read back (unlike pickle)
+FRAME_FORMAT = 'parquet' if pa is not None else 'csv'
+
+
+def frame_path(dataset_id, name):
+    return cache_path(dataset_id, f"{name}.{FRAME_FORMAT}")
+
+
+def save_frame(df, path):
+    if FRAME_FORMAT == 'parquet':
+        write_atomic(path, lambda tmp_path: df.to_parquet(tmp_path, index=False))
+    else:
+        write_atomic(path, lambda tmp_path: df.to_csv(tmp_path, index=False))
+
+
+def load_frame(path):
+    if FRAME_FORMAT == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+
+#Write a file through a temporary name, so other processes never read a half written file
+def write_atomic(path, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+#Columns each chart reads from its sheet, this is the expected schema checked at upload
+def chart_columns(sheet_name):
+    spec = chart_specs[sheet_name]
+    columns = ['Period', spec.get('y', 'Pv')]
+    if spec.get('group'):
+        columns.append('Commodity')
+    return columns
+
+
+#Columns read from a sheet when it is loaded, the chart columns plus Timeslice for the annual filter
+#other columns are never loaded, so memory scales with what is displayed rather than with the workbook
+def sheet_usecols(sheet_name):
+    columns = set(chart_columns(sheet_name))
+    if chart_specs[sheet_name].get('annual_only', True):
+        columns.add('Timeslice')  # optional, only used if the sheet has it
+    return lambda column: column in columns
+
+
+#Check the headers and a sample of rows from a sheet, returns a list of problems (empty if the sheet is usable)
+def validate_sheet(sample, sheet_name):
+    missing = [column for column in chart_columns(sheet_name) if column not in sample.columns]
+    if missing:
+        return [f"missing column(s) {', '.join(missing)}"]
+    if sample.empty:
+        return ["no data rows"]
+
+    errors = []
+    for column in ['Period', chart_specs[sheet_name].get('y', 'Pv')]:
+        if not pd.api.types.is_numeric_dtype(sample[column]):
+            errors.append(f"column '{column}' is not numeric")
+    return errors
+
+
+#function that reads through file and creates the dictionary of the dataframes
+#only sheets in chart_specs are opened and only the columns their charts use are read,
+#each sheet is profiled from a sample first, only sheets that pass the checks are fully read,
+#the sheets and the problems found per sheet are saved next to the upload for the other processes
+def parse_dataset(dataset_id):
+    dataframes_dict = {}  # Dictionary to store DataFrames
+    sheet_errors = {}  # Dictionary to store the problems found in each sheet
+
+    # an unreadable file raises, so the failure is not cached, and the file is closed once the sheets are read
+    with pd.ExcelFile(dataset_path(dataset_id)) as xls:
+        for sheet_name in xls.sheet_names:
+            if sheet_name not in chart_specs:
+                continue  # no graph uses this sheet, so it is never read
+
+            # a sheet that fails to read is reported and skipped, the other sheets are still loaded
+            try:
+                usecols = sheet_usecols(sheet_name)
+                sample = pd.read_excel(xls, sheet_name=sheet_name, usecols=usecols, nrows=PROFILE_SAMPLE_ROWS)
+                errors = validate_sheet(sample, sheet_name)
+                if errors:
+                    print(f"Skipping sheet '{sheet_name}': {'; '.join(errors)}")
+                    sheet_errors[sheet_name] = errors
+                    continue
+
+                if len(sample) < PROFILE_SAMPLE_ROWS:
+                    df = sample  # the sample already holds the whole sheet
+                else:
+                    df = pd.read_excel(xls, sheet_name=sheet_name, usecols=usecols)
+            except Exception as e:
+                print(f"An error occurred while parsing sheet '{sheet_name}': {str(e)}")
+                sheet_errors[sheet_name] = [f"could not be read ({str(e)})"]
+                continue
+
+            print(f"Loaded DataFrame for sheet '{sheet_name}':\n{df.head()}")
+            dataframes_dict[sheet_name] = df
+            save_frame(df, frame_path(dataset_id, f"sheet-{sheet_name}"))
+
+    # written last, its presence means every sheet above is on disk
+    manifest = {'sheets': list(dataframes_dict), 'errors': sheet_errors}
+    def write_manifest(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+    write_atomic(cache_path(dataset_id, 'sheets.json'), write_manifest)
+
+    return dataframes_dict, sheet_errors
+
+
+#Returns the dataframes and the problems found per sheet, reading the saved sheets if another process
+#already parsed this upload, results are also kept in memory for the most recent uploads
+@functools.lru_cache(maxsize=DATASET_CACHE_SIZE)
+def load_dataset(dataset_id):
+    manifest_path = cache_path(dataset_id, 'sheets.json')
+    if not os.path.exists(manifest_path):
+        return parse_dataset(dataset_id)
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    dataframes_dict = {
+        sheet_name: load_frame(frame_path(dataset_id, f"sheet-{sheet_name}"))
+        for sheet_name in manifest['sheets']
+    }
+    return dataframes_dict, manifest['errors']
+
+
+#Apply the filters and aggregation from chart_specs to a sheet, this is the data behind each graph
+def aggregate_chart(df, sheet_name):
+    spec = chart_specs[sheet_name]
+    y = spec.get('y', 'Pv')
+
+    if spec.get('annual_only', True) and 'Timeslice' in df.columns:
+        df = df[df['Timeslice'] == 'ANNUAL'] #filtering so only annual timeslice is considered
+
+    # Keep only every 5 years
+    df = df[df['Period'] % 5 == 0].copy()
+
+    if not spec.get('aggregate', True):
+        return df[['Period', y]].reset_index(drop=True)
+
+    group = spec.get('group')
+    if group is None:
+        return df.groupby('Period')[y].sum().reset_index()
+
+    suffix = spec.get('strip_suffix')
+    if suffix:
+        # Apply the filter to remove the suffix from the end of 'Commodity'
+        df['Commodity'] = df['Commodity'].apply(lambda x: x[:-len(suffix)] if x.endswith(suffix) else x)
+
+    if group == 'First_Three_Letters':
+        df[group] = df['Commodity'].str[:3]
+    else:
+        df[group] = df['Commodity'].str[-3:]
+    return df.groupby([group, 'Period'])[y].sum().reset_index()
+
+
+#Aggregated data is saved per dataset and chart next to the upload, shared by the graphs and the export API
+#across processes, and kept in memory for the most recent uploads
+@functools.lru_cache(maxsize=DATASET_CACHE_SIZE * len(chart_specs))
+def get_chart_data(dataset_id, sheet_name):
+    path = frame_path(dataset_id, f"chart-{sheet_name}")
+    if os.path.exists(path):
+        return load_frame(path)
+
+    df_dict, _ = load_dataset(dataset_id)
+    if sheet_name not in df_dict:
+        return None
+    df_new = aggregate_chart(df_dict[sheet_name], sheet_name)
+    save_frame(df_new, path)
+    return df_new
+
+
+#Build the plotly figure for a chart from its aggregated data
+def build_figure(df_new, sheet_name):
+    spec = chart_specs[sheet_name]
+    y = spec.get('y', 'Pv')
+    group = spec.get('group')
+
+    if spec['type'] == 'bar':
+        fig = px.bar(df_new, x='Period', y=y, color=group, barmode='stack')
+    else:
+        fig = px.line(df_new, x='Period', y=y, color=group, line_dash=group if spec.get('line_dash') else None)
+
+    layout = {
+        'title': spec['title'],
+        'xaxis_title': "Year",
+        'yaxis_title': spec['yaxis_title'],
+    }
+    if 'legend_title' in spec:
+        layout['legend_title'] = spec['legend_title']
+    fig.update_layout(**layout) #customise the axes and the title, plenty more customisations possible with Dash
+
+    if group is not None:
+        # Modify legend labels based on the three letters of the Commodity codes
+        for trace in fig.data:
+            trace_name = trace.name  # Original trace name (Commodity code)
+            legend_label = naming_convention.get(trace_name, trace_name)  # Get corresponding label from dictionary
+            trace.name = legend_label  # Set the modified legend label
+
+    return fig
+
+
+#List the problems found in each sheet, shown under the upload status
+def sheet_error_list(sheet_errors):
+    if not sheet_errors:
+        return None
+    return html.Ul([
+        html.Li(f"Sheet '{sheet_name}' skipped: {'; '.join(errors)}")
+        for sheet_name, errors in sheet_errors.items()
+    ], style={'color': '#b00'})
+
 
 #Callback which takes the data input and produces the graphs
 @app.callback(
-    [Output('upload-status', 'children'), Output('graph-container', 'children')],
-    [Input('upload-data-em', 'contents')]
+    [Output('upload-status', 'children'), Output('graph-container', 'children'), Output('dataset-id', 'data'),
+     Output('explorer-sheets', 'children'), Output('explorer-sheets', 'active_tab'),
+     Output('explorer-table', 'filter_query'), Output('explorer-table', 'sort_by')],  # cleared for each new upload
+    [Input('upload-data-em', 'contents')],
+    background=background_callback_manager is not None,
 )
 def update_graph(contents_em):
     try:
         if contents_em is None:
-            return "Upload your data to get started.", []
-
-        df_dict = parse_contents(contents_em)
-        if not df_dict:
-            return "No data available.", []
+            return "Upload your data to get started.", [], None, [], None, '', []
+
+        dataset_id = save_upload(contents_em)
+        if dataset_id is None:
+            return "Please upload an Excel (.xlsx) file.", [], None, [], None, '', []
+        try:
+            df_dict, sheet_errors = load_dataset(dataset_id)
+        except Exception as e:
+            print(f"An error occurred while parsing contents: {str(e)}")
+            return f"The file could not be read: {str(e)}", [], None, [], None, '', []
+        sheet_errors = dict(sheet_errors)  # copy, the cached result is shared
+        if not df_dict and not sheet_errors:
+            return "No data available.", [], None, [], None, '', []
 
         graph_list = []
 
-        for sheet_name, df in df_dict.items():
-            if sheet_name not in ['elecgen', 'sermix', 'resmix']:
-                if 'Timeslice' in df.columns:
-                    df = df[df['Timeslice'] == 'ANNUAL'] #filtering so only annual timeslice is considered
-                    
-            # Modify the 'Period' column to include only every 5 years
-            df['Period'] = df['Period'].apply(lambda x: x if x % 5 == 0 else pd.NaT)
-
-                
-            fig1 = None
-            fig2 = None
-            #.... if more figures are required from one dataframe
-                
-    
-            if sheet_name == 'emission':
-                df['First_Three_Letters'] = df['Commodity'].str[:3]
-                df_new = df.groupby(['First_Three_Letters', 'Period'])['Pv'].sum().reset_index()
-                fig1 = px.line(df_new, x='Period', y='Pv', color='First_Three_Letters', line_dash='First_Three_Letters',)
-                fig1.update_layout( #customise the axes and the title, plenty more customisations possible with Dash
-                    title="Emissions",
-                    xaxis_title="Year",
-                    yaxis_title="Mt",
-                    legend_title="Industry",  # Customize legend title if needed
-                )
-            
-                # Modify legend labels based on the first 3 letters of Commodity codes
-                for trace in fig1.data:
-                    trace_name = trace.name  # Original trace name (Commodity code)
-                    legend_label = naming_convention.get(trace_name, trace_name)  # Get corresponding label from dictionary
-                    trace.name = legend_label  # Set the modified legend label
-
-                    
-            elif sheet_name == 'co2price':
-                fig1 = px.line(df, x='Period', y='Pv_update', title=f'Line Chart for {sheet_name}')
-                fig1.update_layout(
-                    title="Carbon Price Over Time",
-                    xaxis_title="Year",
-                    yaxis_title="Price (currency)",
-                    )
-            elif sheet_name == 'eleccap':
-                df_new = df.groupby('Period')['Pv'].sum().reset_index()
-                fig1 = px.line(df_new, x='Period', y='Pv', title=f'Line Chart for {sheet_name}')
-                fig1.update_layout(
-                    title="Electricity Capacity",
-                    xaxis_title="Year",
-                    yaxis_title="Total Capacity (GW)",
-                    )
-            elif sheet_name == 'elecgen':
-                df_new = df.groupby('Period')['Pv'].sum().reset_index()
-                fig1 = px.line(df_new, x='Period', y='Pv', title=f'Line Chart for {sheet_name}')
-                fig1.update_layout(
-                    title = "Electricity Generated",
-                    xaxis_title="Year",
-                    yaxis_title="Electricity Generated (PJ)",
+        for sheet_name in df_dict:
+            try:
+                fig1 = build_figure(get_chart_data(dataset_id, sheet_name), sheet_name)
+            except Exception as e:
+                # a bad value further down the sheet than the sample only loses this graph
+                print(f"Could not plot sheet '{sheet_name}': {str(e)}")
+                sheet_errors[sheet_name] = [str(e)]
+                continue
+
+            graph_list.append(
+                dbc.Col(
+                    dcc.Graph(figure=fig1),
+                    width=6  # Each graph takes half the width
                 )
+            )
+
+        if not graph_list:
+            status = html.Div(["No graphs could be drawn from this file.", sheet_error_list(sheet_errors)])
+            return status, [], None, [], None, '', []
+
+        export_url = f"/api/datasets/{dataset_id}/charts"
+        status = html.Div([
+            "Data uploaded successfully. ",
+            "Chart data can be downloaded from ",
+            html.A(export_url, href=export_url, target="_blank"),
+            sheet_error_list(sheet_errors),
+        ])
+        explorer_tabs = [dbc.Tab(label=sheet_name, tab_id=sheet_name) for sheet_name in df_dict]
+        return status, graph_list, dataset_id, explorer_tabs, next(iter(df_dict)), '', []
 
-                
-            
-            
-            elif sheet_name == 'transemix':
-                df['Last_Three_Letters'] = df['Commodity'].str[-3:]
-                df_new = df.groupby(['Last_Three_Letters', 'Period'])['Pv'].sum().reset_index()
-                fig1 = px.bar(df_new, x='Period', y='Pv', color='Last_Three_Letters', barmode='stack', title=f'Stacked Bar Chart for {sheet_name}')
-                fig1.update_layout(
-                    title="Transport Sector Energy Mix",
-                    xaxis_title="Year",
-                    yaxis_title="PJ",
-                    legend_title="Industry",  # Customize legend title if needed
-                )
-            
-                # Modify legend labels based on the first 3 letters of Commodity codes
-                for trace in fig1.data:
-                    trace_name = trace.name  # Original trace name (Commodity code)
-                    legend_label = naming_convention.get(trace_name, trace_name)  # Get corresponding label from naming convention
-                    trace.name = legend_label  # Set the updated legend label
-                    
-                    
-            elif sheet_name == 'indemix':
-                df['Last_Three_Letters'] = df['Commodity'].str[-3:]
-                df_new = df.groupby(['Last_Three_Letters', 'Period'])['Pv'].sum().reset_index()
-                fig1 = px.bar(df_new, x='Period', y='Pv', color='Last_Three_Letters', barmode='stack', title=f'Stacked Bar Chart for {sheet_name}')
-                fig1.update_layout(
-                    title="Industrial Sector Energy Mix",
-                    xaxis_title="Year",
-                    yaxis_title="PJ",
-                    legend_title="Industry",  # Customize legend title if needed
-                )
-            
-                # Modify legend labels based on the last 3 letters of Commodity codes
-                for trace in fig1.data:
-                    trace_name = trace.name  # Original trace name (Commodity code)
-                    legend_label = naming_convention.get(trace_name, trace_name)  # Get corresponding label from dictionary
-                    trace.name = legend_label  # Set the modified legend label
-                    
-            elif sheet_name == 'resmix':
-                # Apply the filter to remove 'HOUSE' from the end of 'Commodity'
-                df['Commodity'] = df['Commodity'].apply(lambda x: x[:-5] if x.endswith('HOUSE') else x)
-
-                df['Last_Three_Letters'] = df['Commodity'].str[-3:]
-                df_new = df.groupby(['Last_Three_Letters', 'Period'])['Pv'].sum().reset_index()
-                fig1 = px.bar(df_new, x='Period', y='Pv', color='Last_Three_Letters', barmode='stack', title=f'Stacked Bar Chart for {sheet_name}')
-                fig1.update_layout(
-                    title="Residential Sector Energy Mix",
-                    xaxis_title="Year",
-                    yaxis_title="PJ",
-                    legend_title="Industry",  # Customize legend title if needed
-                )
-            
-                # Modify legend labels based on the last 3 letters of Commodity codes
-                for trace in fig1.data:
-                    trace_name = trace.name  # Original trace name (Commodity code)
-                    legend_label = naming_convention.get(trace_name, trace_name)  # Get corresponding label from dictionary
-                    trace.name = legend_label  # Set the modified legend label
-                    
-            elif sheet_name == 'sermix':
-                df['Commodity'] = df['Commodity'].apply(lambda x: x[:-5] if x.endswith('BUILD') else x)
-                df['Last_Three_Letters'] = df['Commodity'].str[-3:]
-                df_new = df.groupby(['Last_Three_Letters', 'Period'])['Pv'].sum().reset_index()
-                fig1 = px.bar(df_new, x='Period', y='Pv', color='Last_Three_Letters', barmode='stack', title=f'Stacked Bar Chart for {sheet_name}')
-                fig1.update_layout(
-                    title="Service Sector Energy Mix",
-                    xaxis_title="Year",
-                    yaxis_title="Mt",
-                    legend_title="Industry",  # Customize legend title if needed
-                )
-            
-                # Modify legend labels based on the last 3 letters of Commodity codes
-                for trace in fig1.data:
-                    trace_name = trace.name  # Original trace name (Commodity code)
-                    legend_label = naming_convention.get(trace_name, trace_name)  # Get corresponding label from dictionary
-                    trace.name = legend_label  # Set the modified legend label
-                    
-            
-            
-            if fig1 is not None:
-                graph_list.append(
-                    dbc.Col(
-                        dcc.Graph(figure=fig1),
-                        width=6  # Each graph takes half the width
-                    )
-                )
+    except Exception as e:
+        traceback_str = traceback.format_exc()
+        error_msg = f"Callback error: {str(e)}\n{traceback_str}"
+        print(error_msg)
+        return "An error occurred while processing the data.", [], None, [], None, '', []
+
+
+#Data explorer, pages of the loaded sheets with sorting and filtering done on the server
+#so the browser only ever receives one page of rows
+explorer_operators = [['ge ', '>='],
+                      ['le ', '<='],
+                      ['lt ', '<'],
+                      ['gt ', '>'],
+                      ['ne ', '!='],
+                      ['eq ', '='],
+                      ['contains '],
+                      ['datestartswith ']]
+
+
+#Split one part of the DataTable filter query, e.g. '{Pv} > 10', into column, operator and value
+def split_filter_part(filter_part):
+    for operator_type in explorer_operators:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+
+                value_part = value_part.strip()
+                v0 = value_part[0] if value_part else ''
+                if v0 == value_part[-1:] and v0 in ("'", '"', '`'):
+                    value = value_part[1: -1].replace('\\' + v0, v0)
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+
+                # word operators need spaces after them in the filter string,
+                # but we don't want these later
+                return name, operator_type[0].strip(), value
+
+    return [None] * 3
+
+
+#Row positions of a sheet after filtering and sorting, None when the sheet is shown as it is.
+#Only the positions are cached, so paging through a view slices the loaded sheet rather than a copy of it
+@functools.lru_cache(maxsize=EXPLORER_CACHE_SIZE)
+def explorer_rows(dataset_id, sheet_name, filter_query, sort_by):
+    df = load_dataset(dataset_id)[0][sheet_name]
+    view = df
+
+    for filter_part in filter_query.split(' && ') if filter_query else []:
+        col_name, operator, filter_value = split_filter_part(filter_part)
+        if col_name not in view.columns:
+            continue
+        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            try:
+                view = view.loc[getattr(view[col_name], operator)(filter_value)]
+            except TypeError:
+                continue  # e.g. comparing a text column with a number, ignore that part of the filter
+        elif operator == 'contains':
+            view = view.loc[view[col_name].astype(str).str.contains(str(filter_value), regex=False)]
+        elif operator == 'datestartswith':
+            view = view.loc[view[col_name].astype(str).str.startswith(str(filter_value))]
+
+    sort_by = [(col_name, direction) for col_name, direction in sort_by if col_name in view.columns]
+    if sort_by:
+        view = view.sort_values(
+            [col_name for col_name, _ in sort_by],
+            ascending=[direction == 'asc' for _, direction in sort_by],
+            kind='stable',
+        )
+
+    if view is df:
+        return None
+    return df.index.get_indexer(view.index).astype(np.int64)
+
+
+#The page is reset to the first one whenever the dataset, sheet, filter or sort changes
+@app.callback(
+    [Output('explorer-table', 'data'), Output('explorer-table', 'columns'), Output('explorer-table', 'page_count'),
+     Output('explorer-table', 'page_current')],
+    [Input('dataset-id', 'data'), Input('explorer-sheets', 'active_tab'), Input('explorer-table', 'page_current'),
+     Input('explorer-table', 'page_size'), Input('explorer-table', 'sort_by'), Input('explorer-table', 'filter_query')],
+)
+def update_explorer(dataset_id, sheet_name, page_current, page_size, sort_by, filter_query):
+    if not dataset_id or not sheet_name:
+        return [], [], 0, 0
 
-            if fig2 is not None: #this allows you to plot several figures from one dataframe
-                graph_list.append(
-                    dbc.Col(
-                        dcc.Graph(figure=fig2),
-                        width=6  # Each graph takes half the width
-                    )
-                )
+    # the sheets were saved next to the upload by update_graph, so this reads them rather than the workbook
+    try:
+        df = load_dataset(dataset_id)[0].get(sheet_name)
+    except Exception as e:
+        print(f"Could not load sheet '{sheet_name}' for the explorer: {str(e)}")
+        return [], [], 0, 0
+    if df is None:
+        return [], [], 0, 0
+
+    if 'explorer-table.page_current' not in ctx.triggered_prop_ids:
+        page_current = 0  # triggered by something other than the page buttons
+    page_current = page_current or 0
+
+    sort_key = tuple((col['column_id'], col['direction']) for col in sort_by or [])
+    rows = explorer_rows(dataset_id, sheet_name, filter_query or '', sort_key)
+    n_rows = len(df) if rows is None else len(rows)
+    start, end = page_current * page_size, (page_current + 1) * page_size
+    page = df.iloc[start:end] if rows is None else df.iloc[rows[start:end]]
+
+    # numeric columns are typed so the table filters them with numeric comparisons rather than 'contains'
+    columns = [
+        {'name': column, 'id': column, 'type': 'numeric'} if pd.api.types.is_numeric_dtype(df[column])
+        else {'name': column, 'id': column}
+        for column in df.columns
+    ]
+    page_count = max(1, -(-n_rows // page_size))
+    return page.to_dict('records'), columns, page_count, page_current
+
+
+#Export API, serves the aggregated data behind each graph so it can be used outside the dashboard
+#GET /api/datasets/<dataset_id>/charts lists the charts, and
+#GET /api/datasets/<dataset_id>/charts/<sheet_name>?format=csv|json|arrow streams one of them
+def stream_csv(df):
+    yield df.iloc[:0].to_csv(index=False)  # header row
+    for start in range(0, len(df), EXPORT_CHUNK_ROWS):
+        yield df.iloc[start:start + EXPORT_CHUNK_ROWS].to_csv(index=False, header=False)
+
+
+def stream_json(df):
+    yield '['
+    first = True
+    for start in range(0, len(df), EXPORT_CHUNK_ROWS):
+        records = df.iloc[start:start + EXPORT_CHUNK_ROWS].to_json(orient='records')[1:-1]
+        yield records if first else ',' + records
+        first = False
+    yield ']'
+
+
+def stream_arrow(df):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=EXPORT_CHUNK_ROWS):
+            writer.write_batch(batch)
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    yield sink.getvalue()  # end of stream marker
+
+
+export_formats = {
+    'csv': ('text/csv', stream_csv),
+    'json': ('application/json', stream_json),
+}
+if pa is not None:
+    export_formats['arrow'] = ('application/vnd.apache.arrow.stream', stream_arrow)
 
 
+def export_error(status, message):
+    return jsonify({'error': message}), status
 
-        return "Data uploaded successfully.", graph_list
 
+@server.route('/api/datasets/<dataset_id>/charts')
+def list_charts(dataset_id):
+    if not DATASET_ID_PATTERN.fullmatch(dataset_id) or not os.path.exists(dataset_path(dataset_id)):
+        return export_error(404, f"Unknown dataset '{dataset_id}'")
+    try:
+        df_dict, sheet_errors = load_dataset(dataset_id)
     except Exception as e:
-        traceback_str = traceback.format_exc()
-        error_msg = f"Callback error: {str(e)}\n{traceback_str}"
-        print(error_msg)
-        return "An error occurred while processing the data.", []
+        return export_error(422, f"The dataset could not be read: {str(e)}")
+    return jsonify({
+        'dataset_id': dataset_id,
+        'formats': list(export_formats),
+        'charts': {sheet_name: chart_specs[sheet_name]['title'] for sheet_name in df_dict},
+        'errors': sheet_errors,
+    })
+
+
+@server.route('/api/datasets/<dataset_id>/charts/<sheet_name>')
+def export_chart(dataset_id, sheet_name):
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export_formats:
+        return export_error(400, f"Unsupported format '{fmt}', choose from {', '.join(export_formats)}")
+    if not DATASET_ID_PATTERN.fullmatch(dataset_id) or not os.path.exists(dataset_path(dataset_id)):
+        return export_error(404, f"Unknown dataset '{dataset_id}'")
+    if sheet_name not in chart_specs:
+        return export_error(404, f"Unknown chart '{sheet_name}'")
+
+    # The dataset id is a hash of the upload, so the tag only changes with the file, the chart definitions,
+    # the chart or the format. Compressed variants of the tag (e.g. '<tag>:gzip') are accepted too
+    etag = f"{dataset_id}-{CHART_SPECS_VERSION}-{sheet_name}-{fmt}"
+    if any(request.if_none_match.contains(tag) for tag in (etag, f"{etag}:gzip", f"{etag}:br")):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    try:
+        df_new = get_chart_data(dataset_id, sheet_name)
+    except Exception as e:
+        print(f"Could not export chart '{sheet_name}': {str(e)}")
+        return export_error(422, f"Could not build chart '{sheet_name}' from this dataset: {str(e)}")
+    if df_new is None:
+        return export_error(404, f"Chart '{sheet_name}' is not in this dataset")
+
+    mimetype, stream = export_formats[fmt]
+    response = Response(stream(df_new), mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, max-age=0, must-revalidate'
+    response.headers['Content-Disposition'] = f'attachment; filename="{sheet_name}.{fmt}"'
+    return response
 
 
+#Development server only, use gunicorn (see gunicorn.conf.py) for production
 if __name__ == '__main__':
-    app.run_server(debug=True, port = 8152)
+    app.run(debug=DEBUG, host=HOST, port=PORT)
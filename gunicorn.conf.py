@@ -0,0 +1,11 @@
+#Gunicorn settings for serving the dashboard in production, run with:
+#    gunicorn dash_TIMES_dashboard:server
+#Worker and thread counts can be changed through the environment without editing this file
+import multiprocessing
+import os
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', 8152)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('THREADS', 4))
+worker_class = 'gthread'  # threaded workers so several users can upload at once
+timeout = int(os.environ.get('TIMEOUT', 120))  # large workbooks can take a while to parse